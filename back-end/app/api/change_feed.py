@@ -0,0 +1,311 @@
+from fastapi import APIRouter, Query, Header
+from fastapi.responses import StreamingResponse
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import asyncio, json, os, signal, threading, uuid, logging
+
+from .update_builder.result import OUTPUT_DIR
+from .update_builder.upload_debs import DEBS_DIR
+from .update_archives.pull_archive import ARCHIVE_PATH
+
+# Native change notifications (inotify / ReadDirectoryChangesW); polling is the fallback
+try:
+    import watchfiles
+except ImportError:
+    watchfiles = None
+
+router = APIRouter(prefix="/changes", tags=["changes"])
+logger = logging.getLogger("uvicorn")
+
+POLL_INTERVAL = 2.0       # seconds between rescans when polling
+HISTORY_SIZE = 1000       # events kept for clients resuming with Last-Event-ID
+KEEPALIVE_INTERVAL = 15   # seconds between SSE keep-alive comments
+
+# (root name, path relative to the root) -> (mtime_ns, size)
+Snapshot = Dict[Tuple[str, str], Tuple[int, int]]
+
+# directory -> (directory mtime_ns, [file names], [subdirectories])
+DirectoryCache = Dict[str, Tuple[int, List[str], List[str]]]
+
+
+def is_partial(name: str) -> bool:
+    """Temp files from in-progress uploads and tier moves; they only become real on rename"""
+    return name.startswith(".") and name.endswith(".part")
+
+
+class ChangeFeed:
+    """
+    One watcher over a set of directories, fanned out to any number of subscribers.
+
+    Every change found is numbered with a sequence number and kept in a bounded history,
+    so a client that reconnects can pick up where it left off. Sequence numbers restart with
+    the server, so event ids also carry a per-process boot id: "<boot id>:<seq>".
+    """
+
+    def __init__(self, roots: Dict[str, Path]):
+        self.roots = roots
+        self.boot_id = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.snapshot: Snapshot = {}
+        self.subscribers = 0
+        self.closed = asyncio.Event()
+        self._subscribed = asyncio.Event()
+        self._condition = asyncio.Condition()
+        self._directories: DirectoryCache = {}
+
+    def scan(self, invalidate: Iterable[str] = ()) -> Snapshot:
+        """
+        Snapshot every file under the roots.
+
+        A directory is only listed again when its own mtime changed (a file was added, removed
+        or renamed in it), or when it is passed in `invalidate`. Every known file is still
+        stat'ed on each scan, so files rewritten or appended in place show up as modified.
+        """
+        cache = self._directories
+        for directory in invalidate:
+            cache.pop(directory, None)
+
+        snapshot = {}
+        directories: DirectoryCache = {}
+        for name, root in self.roots.items():
+            stack = [str(root)]
+            while stack:
+                directory = stack.pop()
+                try:
+                    dir_mtime = os.stat(directory).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+
+                cached = cache.get(directory)
+                if cached is not None and cached[0] == dir_mtime:
+                    _, file_names, subdirectories = cached
+                else:
+                    file_names, subdirectories = [], []
+                    try:
+                        entries = list(os.scandir(directory))
+                    except FileNotFoundError:
+                        continue
+                    for entry in entries:
+                        try:
+                            if entry.is_dir():
+                                subdirectories.append(entry.path)
+                            elif entry.is_file() and not is_partial(entry.name):
+                                file_names.append(entry.name)
+                        except FileNotFoundError:
+                            continue
+                directories[directory] = (dir_mtime, file_names, subdirectories)
+
+                rel_dir = Path(directory).relative_to(root)
+                for file_name in file_names:
+                    try:
+                        stats = os.stat(os.path.join(directory, file_name))
+                    except FileNotFoundError:
+                        continue
+                    snapshot[(name, (rel_dir / file_name).as_posix())] = (stats.st_mtime_ns, stats.st_size)
+                stack.extend(subdirectories)
+
+        self._directories = directories
+        return snapshot
+
+    @staticmethod
+    def diff(old: Snapshot, new: Snapshot) -> List[dict]:
+        changes = []
+        for key, (mtime_ns, size) in new.items():
+            previous = old.get(key)
+            if previous is None:
+                change_type = "added"
+            elif previous != (mtime_ns, size):
+                change_type = "modified"
+            else:
+                continue
+            changes.append({"type": change_type, "root": key[0], "path": key[1], "size": size, "mtime": mtime_ns / 1e9})
+        for key in old.keys() - new.keys():
+            changes.append({"type": "removed", "root": key[0], "path": key[1]})
+        return changes
+
+    async def rescan(self, invalidate: Iterable[str] = ()):
+        loop = asyncio.get_running_loop()
+        snapshot = await loop.run_in_executor(None, self.scan, list(invalidate))
+        changes = self.diff(self.snapshot, snapshot)
+        self.snapshot = snapshot
+        if not changes:
+            return
+        async with self._condition:
+            for change in changes:
+                self.seq += 1
+                self.history.append({"seq": self.seq, **change})
+            self._condition.notify_all()
+
+    async def run(self):
+        """Watch the roots until cancelled"""
+        for root in self.roots.values():
+            root.mkdir(parents=True, exist_ok=True)
+        loop = asyncio.get_running_loop()
+        self.snapshot = await loop.run_in_executor(None, self.scan)
+
+        if watchfiles is not None:
+            try:
+                logger.info("Change feed watching with native notifications")
+                # The notification only says roughly what changed; the rescan works out the events
+                async for changes in watchfiles.awatch(*self.roots.values(), stop_event=self.closed):
+                    await self.rescan(os.path.dirname(path) for _, path in changes)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Native file watching failed, falling back to polling: {str(e)}")
+
+        logger.info(f"Change feed polling every {POLL_INTERVAL}s while clients are subscribed")
+        while not self.closed.is_set():
+            if self.subscribers:
+                await asyncio.sleep(POLL_INTERVAL)
+            else:
+                # Nobody is listening - don't touch the disk until someone subscribes
+                self._subscribed.clear()
+                await self._subscribed.wait()
+            try:
+                await self.rescan()
+            except Exception as e:
+                logger.error(f"Change feed scan failed: {str(e)}")
+
+    def subscribe(self):
+        self.subscribers += 1
+        self._subscribed.set()
+
+    def unsubscribe(self):
+        self.subscribers -= 1
+
+    async def close(self):
+        """End every open stream, so the server can shut down"""
+        self.closed.set()
+        self._subscribed.set()
+        async with self._condition:
+            self._condition.notify_all()
+
+    def close_on_exit_signal(self):
+        """
+        Close the feed as soon as the server is told to exit.
+
+        uvicorn waits for open connections to finish before it runs the lifespan shutdown,
+        so closing from there alone would leave it waiting on the SSE streams forever.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM, getattr(signal, "SIGBREAK", None)):
+            previous = signal.getsignal(sig) if sig is not None else None
+            if not callable(previous):
+                continue
+
+            def handle_exit(signum, frame, previous=previous):
+                loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self.close()))
+                previous(signum, frame)
+
+            signal.signal(sig, handle_exit)
+
+    def event_id(self, seq: int) -> str:
+        return f"{self.boot_id}:{seq}"
+
+    def parse_event_id(self, event_id: str) -> Optional[int]:
+        """The seq in an event id handed out by this server run, or None for any other id"""
+        boot_id, _, seq = event_id.rpartition(":")
+        if boot_id != self.boot_id or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def events_since(self, since: int) -> Optional[List[dict]]:
+        """Events after `since`, or None if some of them have already dropped out of the history"""
+        if since > self.seq:
+            # not a sequence number this run has handed out
+            return None
+        if since == self.seq:
+            return []
+        oldest = self.history[0]["seq"] if self.history else self.seq + 1
+        if since < oldest - 1:
+            return None
+        return [event for event in self.history if event["seq"] > since]
+
+    async def wait(self, since: int, timeout: float) -> bool:
+        """Wait until there are events after `since` or the feed closes; False on timeout"""
+        async with self._condition:
+            try:
+                await asyncio.wait_for(
+                    self._condition.wait_for(lambda: self.seq > since or self.closed.is_set()),
+                    timeout
+                )
+                return True
+            except asyncio.TimeoutError:
+                return False
+
+
+feed = ChangeFeed({
+    "output": OUTPUT_DIR,
+    "archive": ARCHIVE_PATH,
+    "debs": DEBS_DIR,
+})
+
+
+def format_sse(event: str, data: dict, event_id: Optional[str] = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+@router.get("/stream")
+async def stream_changes(
+    roots: Optional[str] = Query(None),
+    since: Optional[str] = Query(None),
+    last_event_id: Optional[str] = Header(None)
+):
+    """
+    Server-sent events for file changes in _output, .archive and the debs directory.
+
+    Args:
+        roots: Optional comma separated filter, e.g. "output,archive"
+        since: Event id ("<boot id>:<seq>") to resume after; a Last-Event-ID header takes precedence
+
+    Each `change` event carries seq, type (added/modified/removed), root and path. If the
+    requested resume point is older than the kept history, or comes from an earlier run of the
+    server, a `reset` event is sent and the client should re-fetch its listing.
+    """
+    wanted = set(roots.split(",")) if roots else set(feed.roots)
+    # On an automatic reconnect the browser repeats the original URL, so Last-Event-ID wins over ?since=
+    resume_from = last_event_id or since
+
+    async def event_stream():
+        feed.subscribe()
+        try:
+            # None when the id comes from an earlier server run: its seq means nothing here, so reset
+            cursor = feed.parse_event_id(resume_from) if resume_from else feed.seq
+            yield "retry: 3000\n\n"
+            # Carries an id too, so a client that reconnects before any change still resumes from here
+            yield format_sse(
+                "ready",
+                {"seq": feed.seq, "boot": feed.boot_id},
+                feed.event_id(cursor) if cursor is not None else None
+            )
+            while not feed.closed.is_set():
+                events = feed.events_since(cursor) if cursor is not None else None
+                if events is None:
+                    cursor = feed.seq
+                    yield format_sse("reset", {"seq": cursor, "boot": feed.boot_id}, feed.event_id(cursor))
+                    continue
+                for event in events:
+                    cursor = event["seq"]
+                    if event["root"] in wanted:
+                        yield format_sse("change", event, feed.event_id(cursor))
+                if not await feed.wait(cursor, KEEPALIVE_INTERVAL):
+                    yield ": keep-alive\n\n"
+        finally:
+            feed.unsubscribe()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,9 +1,11 @@
-from fastapi import APIRouter, UploadFile, HTTPException, File
+from fastapi import APIRouter, HTTPException, Request
 
 from pydantic import BaseModel, constr
 from pathlib import Path
 from typing import Annotated
 
+from ..streaming_upload import stream_upload, StreamingUploadError
+
 router = APIRouter(prefix="/inputs")
 
 commands_dir = Path("C:/Users/christian.leonard/Documents/code/IoT/Stratus/commands")
@@ -35,10 +37,23 @@ async def save_serial_numbers(payload: SerialNumberInput):
 
 
 @router.post("/json-file")
-async def receive_file(file: UploadFile = File(...)):
+async def receive_file(request: Request):
+    # stream the first uploaded file straight over SAVE_PATH_JSON instead of buffering it in memory
+    received = []
+
+    def resolve_destination(filename: str):
+        if received:
+            return None
+        received.append(filename)
+        return SAVE_PATH_JSON
+
     try:
-        contents = await file.read()
-        SAVE_PATH_JSON.write_bytes(contents)
-        return {"message": f"File saved successfully as {SAVE_PATH_JSON.name}"}
+        streamed = await stream_upload(request, resolve_destination)
+    except StreamingUploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if not streamed:
+        raise HTTPException(status_code=400, detail="No file provided")
+    return {"message": f"File saved successfully as {SAVE_PATH_JSON.name}"}
\ No newline at end of file
@@ -0,0 +1,201 @@
+from fastapi import Request
+from pathlib import Path
+from typing import Callable, List, Optional
+from dataclasses import dataclass, field
+from python_multipart.multipart import MultipartParser, parse_options_header
+from python_multipart.exceptions import MultipartParseError
+import hashlib, os, tempfile, asyncio, logging
+
+logger = logging.getLogger("uvicorn")
+
+# Resolves an uploaded filename to its final path on disk, or None to skip the part
+DestinationResolver = Callable[[str], Optional[Path]]
+
+
+class StreamingUploadError(Exception):
+    """Raised when a multipart request body cannot be parsed"""
+
+
+@dataclass
+class StreamedFile:
+    """A file part that was streamed to disk and committed to its destination"""
+    field_name: str
+    filename: str
+    path: Path
+    size: int
+    sha256: str
+
+
+@dataclass
+class _Part:
+    headers: List[tuple] = field(default_factory=list)
+    field_name: str = ""
+    filename: Optional[str] = None
+    destination: Optional[Path] = None
+    tmp_path: Optional[Path] = None
+    handle: Optional[object] = None
+    size: int = 0
+    digest: Optional[object] = None
+
+    def open(self):
+        """Create the temp file next to the destination so the final rename never copies"""
+        self.destination.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.destination.parent, prefix=f".{self.destination.name}.", suffix=".part")
+        self.tmp_path = Path(tmp)
+        self.handle = os.fdopen(fd, "wb")
+        self.digest = hashlib.sha256()
+
+    def write(self, data: bytes):
+        self.handle.write(data)
+        self.digest.update(data)
+        self.size += len(data)
+
+    def commit(self) -> Path:
+        """Flush the temp file to disk and atomically rename it over the destination"""
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+        self.handle.close()
+        self.handle = None
+        os.replace(self.tmp_path, self.destination)
+        self.tmp_path = None
+        return self.destination
+
+    def discard(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+        if self.tmp_path is not None:
+            self.tmp_path.unlink(missing_ok=True)
+            self.tmp_path = None
+
+
+async def stream_upload(request: Request, resolve_destination: DestinationResolver) -> List[StreamedFile]:
+    """
+    Parse a multipart/form-data request body and write every file part straight to its destination.
+
+    Each file part is written once into a temp file in the destination directory, hashed while
+    it streams, and renamed into place when the part ends. Nothing is spooled in memory or in
+    the system temp directory. Plain form fields are ignored.
+
+    Args:
+        request: The incoming request; its body must not have been read yet
+        resolve_destination: Maps an uploaded filename to its final path, or None to skip it
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data":
+        raise StreamingUploadError(f"Expected multipart/form-data, got {content_type.decode('latin-1') or 'no content type'}")
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise StreamingUploadError("Missing boundary in multipart body")
+    charset = params.get(b"charset", b"utf-8").decode("latin-1")
+
+    # The parser callbacks are synchronous, so they only queue events; the file I/O
+    # happens below, in a worker thread, after each chunk has been fed to the parser.
+    events = []
+    state = {"part": None, "header_field": b"", "header_value": b""}
+
+    def on_part_begin():
+        state["part"] = _Part()
+
+    def on_header_field(data: bytes, start: int, end: int):
+        state["header_field"] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int):
+        state["header_value"] += data[start:end]
+
+    def on_header_end():
+        state["part"].headers.append((state["header_field"].lower(), state["header_value"]))
+        state["header_field"] = b""
+        state["header_value"] = b""
+
+    def on_headers_finished():
+        part = state["part"]
+        disposition = dict(part.headers).get(b"content-disposition", b"")
+        _, options = parse_options_header(disposition)
+        part.field_name = options.get(b"name", b"").decode(charset, errors="replace")
+        if b"filename" in options:
+            part.filename = options[b"filename"].decode(charset, errors="replace")
+            events.append(("begin", part, None))
+
+    def on_part_data(data: bytes, start: int, end: int):
+        part = state["part"]
+        if part.filename is not None:
+            events.append(("data", part, data[start:end]))
+
+    def on_part_end():
+        part = state["part"]
+        if part.filename is not None:
+            events.append(("end", part, None))
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+    })
+
+    loop = asyncio.get_running_loop()
+    streamed: List[StreamedFile] = []
+    open_parts: List[_Part] = []
+
+    def handle_events(batch):
+        for kind, part, data in batch:
+            if kind == "begin":
+                part.destination = resolve_destination(part.filename)
+                if part.destination is None:
+                    logger.warning(f"Skipping unsupported file: {part.filename}")
+                    continue
+                part.open()
+                open_parts.append(part)
+            elif part.destination is None:
+                continue
+            elif kind == "data":
+                part.write(data)
+            else:
+                path = part.commit()
+                open_parts.remove(part)
+                logger.info(f"Streamed {part.filename} → {path} ({part.size} bytes)")
+                streamed.append(StreamedFile(
+                    field_name=part.field_name,
+                    filename=part.filename,
+                    path=path,
+                    size=part.size,
+                    sha256=part.digest.hexdigest(),
+                ))
+
+    def discard_open_parts():
+        for part in open_parts:
+            part.discard()
+
+    pending = None
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if events:
+                batch = events[:]
+                events.clear()
+                # shielded so a client disconnect can't abandon the worker mid-write
+                pending = loop.run_in_executor(None, handle_events, batch)
+                await asyncio.shield(pending)
+        parser.finalize()
+    except BaseException as e:
+        # The worker keeps running after a cancellation; let it finish before touching its files
+        if pending is not None and not pending.done():
+            try:
+                await pending
+            except Exception:
+                pass
+        await loop.run_in_executor(None, discard_open_parts)
+        if isinstance(e, MultipartParseError):
+            raise StreamingUploadError(f"Malformed multipart body: {str(e)}") from e
+        raise
+
+    # A body that ends mid-part never fires on_part_end; don't leave half-written temp files behind
+    for part in open_parts:
+        logger.warning(f"Discarding incomplete upload: {part.filename}")
+    await loop.run_in_executor(None, discard_open_parts)
+
+    return streamed
@@ -0,0 +1,258 @@
+from pathlib import Path
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import json, lzma, os, tempfile, threading, time, logging
+
+logger = logging.getLogger("uvicorn")
+
+CHUNK_SIZE = 1024 * 1024  # 1 MB chunks
+
+COLD_SUFFIX = ".xz"
+INDEX_FILE_NAME = "index.json"
+PARTIAL_SUFFIX = ".part"
+
+# Most recent accesses kept per file; enough to answer "how often in the last window"
+MAX_ACCESS_HISTORY = 32
+
+
+class ArchiveIndex:
+    """
+    Access-frequency tracker and cold-tier metadata, persisted as JSON inside the cold tier.
+
+    Layout of the index file:
+        {"access": {"<rel path>": [timestamp, ...]}, "cold": {"<rel path>": {"size": n, "mtime": t}}}
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._access: Dict[str, List[float]] = {}
+        self._cold: Dict[str, Dict[str, float]] = {}
+        self.load()
+
+    def load(self):
+        try:
+            data = json.loads(self.path.read_text())
+            self._access = data.get("access", {})
+            self._cold = data.get("cold", {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Could not read archive index {self.path}: {str(e)}")
+
+    def save(self):
+        """Write the index atomically if anything changed since the last save"""
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = json.dumps({"access": self._access, "cold": self._cold})
+            self._dirty = False
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=f".{self.path.name}.", suffix=PARTIAL_SUFFIX)
+        with os.fdopen(fd, "w") as out_file:
+            out_file.write(payload)
+        os.replace(tmp, self.path)
+
+    def record_access(self, rel_path: str, when: Optional[float] = None):
+        with self._lock:
+            history = self._access.setdefault(rel_path, [])
+            history.append(when if when is not None else time.time())
+            del history[:-MAX_ACCESS_HISTORY]
+            self._dirty = True
+
+    def last_access(self, rel_path: str) -> Optional[float]:
+        with self._lock:
+            history = self._access.get(rel_path)
+            return history[-1] if history else None
+
+    def accesses_since(self, rel_path: str, since: float) -> int:
+        with self._lock:
+            return sum(1 for t in self._access.get(rel_path, []) if t >= since)
+
+    def cold_info(self, rel_path: str) -> Optional[Dict[str, float]]:
+        with self._lock:
+            return self._cold.get(rel_path)
+
+    def mark_cold(self, rel_path: str, size: int, mtime: float):
+        with self._lock:
+            self._cold[rel_path] = {"size": size, "mtime": mtime}
+            self._dirty = True
+
+    def mark_hot(self, rel_path: str):
+        with self._lock:
+            self._cold.pop(rel_path, None)
+            self._dirty = True
+
+
+def cold_path_for(cold_dir: Path, rel_path: str) -> Path:
+    return cold_dir / (rel_path + COLD_SUFFIX)
+
+
+def iter_cold_files(cold_dir: Path) -> Iterator[Tuple[str, Path]]:
+    """Yield (original relative path, compressed file) for every build in the cold tier"""
+    if not cold_dir.exists():
+        return
+    for root, _, files in os.walk(cold_dir):
+        for name in files:
+            if not name.endswith(COLD_SUFFIX):
+                continue
+            cold_file = Path(root) / name
+            rel_path = cold_file.relative_to(cold_dir).as_posix()[:-len(COLD_SUFFIX)]
+            yield rel_path, cold_file
+
+
+def open_cold_file(cold_file: Path):
+    """Open a cold artifact for reading; it decompresses as it is read, without materialising it on disk"""
+    return lzma.open(cold_file, "rb")
+
+
+def stream_open_file(src) -> Iterator[bytes]:
+    """
+    Stream a file that is already open, chunk by chunk, closing it at the end.
+
+    The file is opened by the caller rather than here, so a tier move that happens before
+    the response starts can't pull it out from under the download.
+    """
+    with src:
+        while chunk := src.read(CHUNK_SIZE):
+            yield chunk
+
+
+def _copy_atomically(src, destination: Path):
+    """Copy a readable stream into destination via a temp file in the same directory"""
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=destination.parent, prefix=f".{destination.name}.", suffix=PARTIAL_SUFFIX)
+    try:
+        with os.fdopen(fd, "wb") as out_file:
+            while chunk := src.read(CHUNK_SIZE):
+                out_file.write(chunk)
+            out_file.flush()
+            os.fsync(out_file.fileno())
+        os.replace(tmp, destination)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def demote(hot_dir: Path, cold_dir: Path, rel_path: str, index: ArchiveIndex, preset: int):
+    """Compress a hot build into the cold tier, then drop the hot copy"""
+    hot_file = hot_dir / rel_path
+    stats = hot_file.stat()
+    cold_file = cold_path_for(cold_dir, rel_path)
+    with open(hot_file, "rb") as src:
+        cold_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cold_file.parent, prefix=f".{cold_file.name}.", suffix=PARTIAL_SUFFIX)
+        try:
+            with os.fdopen(fd, "wb") as raw:
+                with lzma.open(raw, "wb", preset=preset) as out_file:
+                    while chunk := src.read(CHUNK_SIZE):
+                        out_file.write(chunk)
+                raw.flush()
+                os.fsync(raw.fileno())
+            os.replace(tmp, cold_file)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+    os.utime(cold_file, (stats.st_atime, stats.st_mtime))
+    # The cold copy is committed before the hot one disappears, so the build is always downloadable.
+    # If the hot copy can't go (e.g. Windows, while a download still has it open), undo the move.
+    try:
+        hot_file.unlink()
+    except FileNotFoundError:
+        pass  # someone else already finished this move; the cold copy is now the only one, keep it
+    except OSError:
+        cold_file.unlink(missing_ok=True)
+        raise
+    index.mark_cold(rel_path, stats.st_size, stats.st_mtime)
+    logger.info(f"Moved {rel_path} to cold tier ({stats.st_size} → {cold_file.stat().st_size} bytes)")
+
+
+def promote(hot_dir: Path, cold_dir: Path, rel_path: str, index: ArchiveIndex):
+    """Decompress a cold build back into the hot tier, then drop the cold copy"""
+    cold_file = cold_path_for(cold_dir, rel_path)
+    hot_file = hot_dir / rel_path
+    with lzma.open(cold_file, "rb") as src:
+        _copy_atomically(src, hot_file)
+    info = index.cold_info(rel_path)
+    if info:
+        os.utime(hot_file, (time.time(), info["mtime"]))
+    # Same as demote: if a download is still streaming the cold copy, keep it and drop the new one
+    try:
+        cold_file.unlink()
+    except FileNotFoundError:
+        pass  # already moved by someone else; the hot copy is now the only one, keep it
+    except OSError:
+        hot_file.unlink(missing_ok=True)
+        raise
+    index.mark_hot(rel_path)
+    logger.info(f"Moved {rel_path} back to hot tier")
+
+
+def compact(
+    hot_dir: Path,
+    cold_dir: Path,
+    index: ArchiveIndex,
+    cold_after_days: float,
+    access_window_days: float,
+    promote_after_accesses: int,
+    preset: int,
+    workers: int,
+) -> Dict[str, Any]:
+    """
+    Apply the tiering policy once.
+
+    A hot build moves to the cold tier when it is older than cold_after_days and has not been
+    downloaded within access_window_days. A cold build moves back to the hot tier when it has
+    been downloaded at least promote_after_accesses times within access_window_days.
+
+    Two passes must never run at once over the same tiers; the caller serialises them.
+    """
+    now = time.time()
+    age_cutoff = now - cold_after_days * 86400
+    window_start = now - access_window_days * 86400
+    demoted, promoted, failed = [], [], []
+
+    candidates = []
+    if hot_dir.exists():
+        for root, _, files in os.walk(hot_dir):
+            for name in files:
+                if name.startswith(".") and name.endswith(PARTIAL_SUFFIX):
+                    continue
+                hot_file = Path(root) / name
+                rel_path = hot_file.relative_to(hot_dir).as_posix()
+                try:
+                    if hot_file.stat().st_mtime >= age_cutoff:
+                        continue
+                except FileNotFoundError:
+                    continue
+                last_access = index.last_access(rel_path)
+                if last_access is not None and last_access >= window_start:
+                    continue
+                candidates.append(rel_path)
+
+    def demote_one(rel_path: str) -> Tuple[str, bool]:
+        try:
+            demote(hot_dir, cold_dir, rel_path, index, preset)
+            return rel_path, True
+        except Exception as e:
+            logger.error(f"Error moving {rel_path} to cold tier: {str(e)}")
+            return rel_path, False
+
+    # lzma releases the GIL while compressing, so builds are compressed in parallel threads
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for rel_path, ok in executor.map(demote_one, candidates):
+            (demoted if ok else failed).append(rel_path)
+
+    for rel_path, _ in list(iter_cold_files(cold_dir)):
+        if index.accesses_since(rel_path, window_start) < promote_after_accesses:
+            continue
+        try:
+            promote(hot_dir, cold_dir, rel_path, index)
+            promoted.append(rel_path)
+        except Exception as e:
+            logger.error(f"Error moving {rel_path} back to hot tier: {str(e)}")
+            failed.append(rel_path)
+
+    index.save()
+    return {"demoted": demoted, "promoted": promoted, "failed": failed}
@@ -1,13 +1,15 @@
 from fastapi import APIRouter, UploadFile, File, Depends, Body, Query
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from pathlib import Path
 from typing import List, Optional, Dict, Any
-import aiofiles, tempfile, zipfile, os, shutil, asyncio, logging
+import aiofiles, tempfile, zipfile, os, shutil, asyncio, threading, logging
 import datetime
 import re
 import tempfile, zipfile, os, shutil, asyncio, logging
 import datetime
 
+from . import archive_tiers
+
 router = APIRouter(prefix="/archives", tags=["archives"])
 logger = logging.getLogger("uvicorn")
 
@@ -16,6 +18,22 @@ CHUNK_SIZE = 1024 * 1024  # 1 MB chunks
 # Define the archive directory path
 ARCHIVE_PATH = Path("C:/Users/christian.leonard/Documents/code/IoT/Stratus/remote_update_manager/.archive")
 
+# Cold tier: xz-compressed builds that have aged out of the hot archive; can live on a slower volume
+COLD_ARCHIVE_PATH = Path("C:/Users/christian.leonard/Documents/code/IoT/Stratus/remote_update_manager/.archive_cold")
+
+# Tiering policy
+COLD_AFTER_DAYS = 60            # builds older than this are compressed into the cold tier...
+ACCESS_WINDOW_DAYS = 14         # ...unless they were downloaded within this window
+PROMOTE_AFTER_ACCESSES = 3      # cold builds downloaded this often within the window move back to hot
+XZ_PRESET = 6
+COMPACTION_WORKERS = 2            # xz encoders running at once; keeps compaction from starving builds
+COMPACTION_INTERVAL = 6 * 60 * 60  # seconds between background compaction runs
+
+archive_index = archive_tiers.ArchiveIndex(COLD_ARCHIVE_PATH / archive_tiers.INDEX_FILE_NAME)
+
+# Held for a whole compaction pass, so POST /compact and the background loop never move the same build at once
+compaction_lock = threading.Lock()
+
 @router.get("/list")
 async def list_archive_files(
     include_details: bool = Query(True), 
@@ -53,7 +71,8 @@ async def list_archive_files(
                 "name": file_path.name,
                 "path": str(rel_path),
                 "is_directory": False,
-                "parent_dir": str(file_path.parent.name)
+                "parent_dir": str(file_path.parent.name),
+                "tier": "hot"
             }
             
             # Add additional file details if requested
@@ -71,12 +90,48 @@ async def list_archive_files(
                     item_info["error"] = f"Failed to get details: {str(e)}"
                     
             return item_info
+
+        # Function to process a build stored compressed in the cold tier
+        def process_cold_file(rel_path, cold_file):
+            original_path = ARCHIVE_PATH / rel_path
+            if filter_ext and original_path.suffix.lower() != f".{filter_ext.lower()}":
+                return None
+
+            item_info = {
+                "name": original_path.name,
+                "path": str(Path(rel_path)),
+                "is_directory": False,
+                "parent_dir": str(original_path.parent.name),
+                "tier": "cold"
+            }
+
+            if include_details:
+                try:
+                    stats = cold_file.stat()
+                    cold_info = archive_index.cold_info(rel_path) or {}
+                    size = cold_info.get("size", stats.st_size)
+                    item_info.update({
+                        "size": size,
+                        "size_human": format_size(size),
+                        "size_compressed": stats.st_size,
+                        "modified": datetime.datetime.fromtimestamp(stats.st_mtime).isoformat(),
+                        "created": datetime.datetime.fromtimestamp(stats.st_ctime).isoformat(),
+                    })
+                except Exception as e:
+                    logger.error(f"Error getting details for {cold_file}: {str(e)}")
+                    item_info["error"] = f"Failed to get details: {str(e)}"
+
+            return item_info
         
         # Function to process all files in a directory recursively
         def scan_directory(dir_path, results, current_rel_path=""):
             # Process all items in the directory
             for item_path in dir_path.iterdir():
                 rel_path = Path(current_rel_path) / item_path.name
+
+                # Skip half-written files from an in-progress tier move
+                if item_path.name.startswith(".") and item_path.name.endswith(archive_tiers.PARTIAL_SUFFIX):
+                    continue
                 
                 if item_path.is_file():
                     item_info = process_file(item_path, rel_path)
@@ -110,6 +165,14 @@ async def list_archive_files(
         
         # Start the recursive scan
         scan_directory(ARCHIVE_PATH, response["items"])
+
+        # Cold builds are listed under their original path so they download like any other
+        for rel_path, cold_file in archive_tiers.iter_cold_files(COLD_ARCHIVE_PATH):
+            if not recursive and "/" in rel_path:
+                continue
+            item_info = process_cold_file(rel_path, cold_file)
+            if item_info:
+                response["items"].append(item_info)
         
         # Extract build info from update filenames when possible
         for item in response["items"]:
@@ -173,30 +236,54 @@ async def download_archive_file(file_path: str):
         absolute_path = (ARCHIVE_PATH / file_path).resolve()
         
         # Security check - make sure the resolved path is still within the archive directory
-        if not str(absolute_path).startswith(str(ARCHIVE_PATH)):
+        if not absolute_path.is_relative_to(ARCHIVE_PATH.resolve()):
             return JSONResponse(
                 status_code=403,
                 content={"error": "Access denied: attempting to access file outside archive directory"}
             )
         
-        # Check if file exists
-        if not absolute_path.exists():
-            return JSONResponse(
-                status_code=404,
-                content={"error": f"File not found: {file_path}"}
-            )
-            
-        if not absolute_path.is_file():
+        rel_path = absolute_path.relative_to(ARCHIVE_PATH.resolve()).as_posix()
+
+        if absolute_path.is_dir():
             return JSONResponse(
                 status_code=400,
                 content={"error": f"Path is not a file: {file_path}"}
             )
-            
+
+        # Open the build here rather than in the response: compaction can move it between tiers
+        # at any moment, and an open file stays readable. If it moved between the two opens,
+        # look in the other tier again.
+        cold_file = archive_tiers.cold_path_for(COLD_ARCHIVE_PATH, rel_path)
+        headers = {"Content-Disposition": f'attachment; filename="{absolute_path.name}"'}
+        src = None
+        for tier in ("hot", "cold", "hot"):
+            try:
+                if tier == "hot":
+                    src = open(absolute_path, "rb")
+                    headers["Content-Length"] = str(os.fstat(src.fileno()).st_size)
+                else:
+                    # Not in the hot archive - serve it from the cold tier, decompressing as it streams
+                    src = archive_tiers.open_cold_file(cold_file)
+                    cold_info = archive_index.cold_info(rel_path)
+                    if cold_info:
+                        headers["Content-Length"] = str(cold_info["size"])
+                break
+            except FileNotFoundError:
+                continue
+
+        if src is None:
+            return JSONResponse(
+                status_code=404,
+                content={"error": f"File not found: {file_path}"}
+            )
+
+        archive_index.record_access(rel_path)
+
         # Return the file
-        return FileResponse(
-            path=absolute_path,
-            filename=absolute_path.name,
-            media_type="application/octet-stream"
+        return StreamingResponse(
+            archive_tiers.stream_open_file(src),
+            media_type="application/octet-stream",
+            headers=headers
         )
         
     except Exception as e:
@@ -207,6 +294,46 @@ async def download_archive_file(file_path: str):
         )
 
 
+@router.post("/compact")
+async def compact_archive():
+    """Apply the tiering policy now instead of waiting for the background task"""
+    try:
+        loop = asyncio.get_event_loop()
+        result = await loop.run_in_executor(None, run_compaction)
+        return {"message": f"Moved {len(result['demoted'])} builds to cold tier, {len(result['promoted'])} back to hot", **result}
+    except Exception as e:
+        logger.error(f"Error compacting archive: {str(e)}")
+        return {"error": f"Failed to compact archive: {str(e)}"}
+
+
+def run_compaction():
+    """Run one pass of the tiering policy over the archive (blocking; waits for a pass already running)"""
+    with compaction_lock:
+        return archive_tiers.compact(
+            ARCHIVE_PATH,
+            COLD_ARCHIVE_PATH,
+            archive_index,
+            cold_after_days=COLD_AFTER_DAYS,
+            access_window_days=ACCESS_WINDOW_DAYS,
+            promote_after_accesses=PROMOTE_AFTER_ACCESSES,
+            preset=XZ_PRESET,
+            workers=COMPACTION_WORKERS,
+        )
+
+
+async def compaction_loop():
+    """Background task that keeps the hot archive small by compacting it periodically"""
+    loop = asyncio.get_event_loop()
+    while True:
+        try:
+            result = await loop.run_in_executor(None, run_compaction)
+            if result["demoted"] or result["promoted"]:
+                logger.info(f"Archive compaction: {len(result['demoted'])} demoted, {len(result['promoted'])} promoted")
+        except Exception as e:
+            logger.error(f"Archive compaction failed: {str(e)}")
+        await asyncio.sleep(COMPACTION_INTERVAL)
+
+
 def format_size(size_bytes):
     """Format file size in a human-readable format"""
     if size_bytes < 0:
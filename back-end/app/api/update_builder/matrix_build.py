@@ -0,0 +1,290 @@
+from fastapi import APIRouter, BackgroundTasks, HTTPException
+from pydantic import BaseModel, Field
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Literal, Optional
+import copy, datetime, os, shutil, subprocess, threading, uuid, logging
+
+from .upload_debs import DEBS_DIR
+from .result import OUTPUT_DIR
+from ..update_archives.pull_archive import ARCHIVE_PATH, COLD_ARCHIVE_PATH
+
+router = APIRouter(prefix="/builder", tags=["builder"])
+logger = logging.getLogger("uvicorn")
+
+UPDATER_DIR = Path("C:/Users/christian.leonard/Documents/code/IoT/Stratus/remote_update_manager")
+BUILD_SCRIPT = "build_deb_package.sh"
+ARCHIVE_SCRIPT = Path("scripts") / "archive.py"
+
+# Each variant builds in its own workspace under here; same volume as debs so they can be hard-linked
+WORKSPACES_DIR = UPDATER_DIR / ".matrix"
+
+# Never copied into a workspace: shared outputs, other workspaces, and debs (linked separately)
+WORKSPACE_EXCLUDES = (ARCHIVE_PATH.name, COLD_ARCHIVE_PATH.name, WORKSPACES_DIR.name, ".git", OUTPUT_DIR.name, DEBS_DIR.name)
+
+# Upper bound on builds running at once, whatever the size of the matrix
+MAX_PARALLEL_BUILDS = max(1, min(4, os.cpu_count() or 1))
+
+BUILD_TIMEOUT = 300
+ARCHIVE_TIMEOUT = 60
+
+# matrix id -> status, kept in memory for the lifetime of the server
+matrix_builds: Dict[str, dict] = {}
+matrix_lock = threading.Lock()
+build_pool = ThreadPoolExecutor(max_workers=MAX_PARALLEL_BUILDS, thread_name_prefix="matrix-build")
+
+
+# The package whose version decides the release type: a trailing "D" (0.1.70D) marks a development build
+VERSION_PACKAGE = "stratus-version"
+
+
+class BuildVariant(BaseModel):
+    name: str = Field(pattern=r"^[A-Za-z0-9_.-]+$")
+    release_type: Literal["development", "public"]
+    # stratus-version to build, e.g. "0.1.70"; picks the matching stratus-version deb
+    version: Optional[str] = None
+    # package name (e.g. "stratus-version") -> deb filename in the debs directory to build with
+    package_overrides: Dict[str, str] = {}
+
+
+class MatrixBuildRequest(BaseModel):
+    variants: List[BuildVariant] = Field(min_length=1)
+
+
+def package_name(deb_name: str) -> str:
+    """stratus-version_0.1.70D-r0_arm64.deb -> stratus-version"""
+    return deb_name.split("_", 1)[0]
+
+
+def package_version(deb_name: str) -> str:
+    """stratus-version_0.1.70D-r0_arm64.deb -> 0.1.70D"""
+    return deb_name.split("_")[1].split("-")[0]
+
+
+def release_type_of(version: str) -> str:
+    return "development" if version.endswith("D") else "public"
+
+
+def select_version_deb(variant: BuildVariant, available: List[Path]) -> str:
+    """
+    Pick the stratus-version deb for a variant.
+
+    The build takes its release type from this deb, so it has to agree with the variant's
+    release_type (and version, if given). An explicit override is checked rather than trusted.
+    """
+    candidates = [deb.name for deb in available if package_name(deb.name) == VERSION_PACKAGE]
+    if VERSION_PACKAGE in variant.package_overrides:
+        candidates = [variant.package_overrides[VERSION_PACKAGE]]
+
+    matching = [
+        name for name in candidates
+        if release_type_of(package_version(name)) == variant.release_type
+        and (variant.version is None or package_version(name).rstrip("D") == variant.version.rstrip("D"))
+    ]
+
+    wanted = f"{variant.release_type} {VERSION_PACKAGE}" + (f" {variant.version}" if variant.version else "")
+    if VERSION_PACKAGE in variant.package_overrides and not matching:
+        raise ValueError(f"Override {candidates[0]} is not a {wanted} build")
+    if not matching:
+        raise ValueError(f"No {wanted} deb in debs directory")
+    if len(matching) > 1:
+        raise ValueError(f"Several {wanted} debs in debs directory, pick one with package_overrides: {', '.join(matching)}")
+    return matching[0]
+
+
+def select_debs(variant: BuildVariant) -> List[Path]:
+    """All debs in the debs directory, with overridden packages narrowed to the requested file"""
+    available = sorted(DEBS_DIR.glob("*.deb"))
+    for package, deb_name in variant.package_overrides.items():
+        if not (DEBS_DIR / deb_name).is_file():
+            raise ValueError(f"Override for {package} not found in debs directory: {deb_name}")
+        if package_name(deb_name) != package:
+            raise ValueError(f"Override {deb_name} is not a build of {package}")
+
+    chosen = dict(variant.package_overrides)
+    chosen[VERSION_PACKAGE] = select_version_deb(variant, available)
+    return [
+        deb for deb in available
+        if package_name(deb.name) not in chosen
+        or chosen[package_name(deb.name)] == deb.name
+    ]
+
+
+def link_or_copy(src: Path, dst: Path):
+    """Hard-link a read-only input into a workspace, falling back to a real copy across volumes"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def create_workspace(workspace: Path, debs: List[Path]):
+    """
+    Give a variant its own copy of the updater tree.
+
+    Scripts and config are copied, so nothing the build writes can leak into the shared tree
+    or another variant. The debs are the large inputs and are only read, so they are
+    hard-linked instead of copied.
+    """
+    shutil.copytree(UPDATER_DIR, workspace, ignore=shutil.ignore_patterns(*WORKSPACE_EXCLUDES))
+    (workspace / "debs").mkdir()
+    for deb in debs:
+        link_or_copy(deb, workspace / "debs" / deb.name)
+
+
+def run_step(args: List[str], cwd: Path, timeout: int) -> dict:
+    try:
+        completed = subprocess.run(
+            args,
+            capture_output=True,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            cwd=str(cwd),
+            timeout=timeout
+        )
+        return {"return_code": completed.returncode, "stdout": completed.stdout, "stderr": completed.stderr}
+    except subprocess.TimeoutExpired:
+        return {"return_code": None, "stdout": "", "stderr": f"Timed out after {timeout} seconds"}
+
+
+def update_variant(matrix_id: str, name: str, **fields):
+    with matrix_lock:
+        matrix_builds[matrix_id]["variants"][name].update(fields)
+
+
+def build_variant(matrix_id: str, variant: BuildVariant) -> Optional[Path]:
+    """Build and archive one variant in its own workspace; returns the workspace archive on success"""
+    workspace = WORKSPACES_DIR / matrix_id / variant.name
+    try:
+        update_variant(matrix_id, variant.name, status="preparing")
+        # The variant is expressed entirely through which debs its workspace gets
+        create_workspace(workspace, select_debs(variant))
+
+        update_variant(matrix_id, variant.name, status="building")
+        build = run_step(["bash", str(workspace / BUILD_SCRIPT)], workspace, BUILD_TIMEOUT)
+        update_variant(matrix_id, variant.name, build=build)
+        if build["return_code"] != 0:
+            logger.error(f"[{matrix_id}/{variant.name}] Build failed: {build['return_code']}")
+            update_variant(matrix_id, variant.name, status="failed")
+            return None
+
+        archive_script = workspace / ARCHIVE_SCRIPT
+        if archive_script.exists():
+            update_variant(matrix_id, variant.name, status="archiving")
+            archive = run_step(["python", str(archive_script)], archive_script.parent, ARCHIVE_TIMEOUT)
+            update_variant(matrix_id, variant.name, archive=archive)
+            if archive["return_code"] != 0:
+                logger.error(f"[{matrix_id}/{variant.name}] Archive script failed: {archive['return_code']}")
+                update_variant(matrix_id, variant.name, status="failed")
+                return None
+
+        update_variant(matrix_id, variant.name, status="built")
+        logger.info(f"[{matrix_id}/{variant.name}] Build finished")
+        return workspace / ".archive"
+    except Exception as e:
+        logger.error(f"[{matrix_id}/{variant.name}] Build failed: {str(e)}")
+        update_variant(matrix_id, variant.name, status="failed", error=str(e))
+        return None
+
+
+def collect_archive(name: str, variant_archive: Path) -> List[str]:
+    """Move one variant's archived builds into the shared archive"""
+    archived = []
+    if not variant_archive.exists():
+        return archived
+    for root, _, files in os.walk(variant_archive):
+        for file_name in files:
+            src = Path(root) / file_name
+            rel_path = src.relative_to(variant_archive)
+            dest = ARCHIVE_PATH / rel_path
+            if dest.exists():
+                # two variants produced the same file name - keep both, without touching the
+                # name, since list_archive_files reads version and build date from it
+                dest = ARCHIVE_PATH / name / rel_path
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(src, dest)
+            archived.append(dest.relative_to(ARCHIVE_PATH).as_posix())
+    return archived
+
+
+def run_matrix(matrix_id: str, variants: List[BuildVariant]):
+    futures = {variant.name: build_pool.submit(build_variant, matrix_id, variant) for variant in variants}
+    archives = {name: future.result() for name, future in futures.items()}
+    archives = {name: path for name, path in archives.items() if path is not None}
+
+    # Move the results into the archive together, once every variant has finished
+    archived = []
+    collected = 0
+    for name, variant_archive in archives.items():
+        try:
+            files = collect_archive(name, variant_archive)
+        except Exception as e:
+            logger.error(f"[{matrix_id}/{name}] Failed to collect archive: {str(e)}")
+            update_variant(matrix_id, name, status="failed", error=f"Failed to collect archive: {str(e)}")
+            continue
+        if not files:
+            logger.error(f"[{matrix_id}/{name}] Build produced nothing in {variant_archive}")
+            update_variant(matrix_id, name, status="failed", error="No archived build found in the variant's workspace")
+            continue
+        update_variant(matrix_id, name, status="archived", archived=files)
+        archived.extend(files)
+        collected += 1
+
+    shutil.rmtree(WORKSPACES_DIR / matrix_id, ignore_errors=True)
+    try:
+        WORKSPACES_DIR.rmdir()
+    except OSError:
+        pass  # another matrix is still running
+
+    with matrix_lock:
+        matrix = matrix_builds[matrix_id]
+        matrix["archived"] = archived
+        matrix["finished"] = datetime.datetime.now().isoformat()
+        matrix["status"] = "succeeded" if collected == len(variants) else "failed"
+    logger.info(f"[{matrix_id}] Matrix build {matrix['status']}: {collected}/{len(variants)} variants archived")
+
+
+@router.post("/build_matrix")
+def trigger_matrix_build(request: MatrixBuildRequest, background_tasks: BackgroundTasks):
+    """
+    Build several update variants in parallel from one request.
+
+    Each variant builds in an isolated workspace, at most MAX_PARALLEL_BUILDS at a time,
+    and the results are moved into the archive together once every variant has finished.
+    """
+    names = [variant.name for variant in request.variants]
+    if len(set(names)) != len(names):
+        raise HTTPException(status_code=400, detail="Variant names must be unique")
+
+    if not (UPDATER_DIR / BUILD_SCRIPT).exists():
+        return {"error": f"Script not found at {UPDATER_DIR / BUILD_SCRIPT}"}
+
+    for variant in request.variants:
+        try:
+            select_debs(variant)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"{variant.name}: {str(e)}")
+
+    matrix_id = datetime.datetime.now().strftime("%Y%m%d%H%M%S") + "-" + uuid.uuid4().hex[:6]
+    with matrix_lock:
+        matrix_builds[matrix_id] = {
+            "id": matrix_id,
+            "status": "running",
+            "started": datetime.datetime.now().isoformat(),
+            "variants": {variant.name: {"status": "queued", **variant.model_dump()} for variant in request.variants},
+        }
+
+    # Run the matrix in the background so request returns immediately
+    background_tasks.add_task(run_matrix, matrix_id, request.variants)
+
+    return {"message": f"Matrix build started with {len(names)} variants", "id": matrix_id}
+
+
+@router.get("/build_matrix/{matrix_id}")
+def get_matrix_build(matrix_id: str):
+    with matrix_lock:
+        matrix = matrix_builds.get(matrix_id)
+        if matrix is None:
+            raise HTTPException(status_code=404, detail=f"Matrix build not found: {matrix_id}")
+        return copy.deepcopy(matrix)
@@ -32,9 +32,9 @@ async def list_output_files():
             return {"files": [], "message": "Output directory was just created, no files yet"}
 
         # List the contents of the output directory
-        logger.info(f"Listing contents of output directory: {OUTPUT_DIR}")
+        logger.debug(f"Listing contents of output directory: {OUTPUT_DIR}")
         directory_contents = list(OUTPUT_DIR.iterdir())
-        logger.info(f"Found {len(directory_contents)} items in output directory")
+        logger.debug(f"Found {len(directory_contents)} items in output directory")
 
         files = []
         # First, check files directly in the output directory
@@ -42,20 +42,20 @@ async def list_output_files():
             if item.is_file():
                 relative_path = str(item.relative_to(OUTPUT_DIR))
                 files.append(relative_path)
-                logger.info(f"Added file from root: {relative_path}")
+                logger.debug(f"Added file from root: {relative_path}")
             elif item.is_dir():
                 # Process subdirectories as before
-                logger.info(f"Processing subfolder: {item.name}")
+                logger.debug(f"Processing subfolder: {item.name}")
                 subfolder_items = list(item.iterdir())
-                logger.info(f"Found {len(subfolder_items)} items in {item.name}")
+                logger.debug(f"Found {len(subfolder_items)} items in {item.name}")
                 
                 for f in subfolder_items:
                     if f.is_file():
                         relative_path = str(f.relative_to(OUTPUT_DIR))
                         files.append(relative_path)
-                        logger.info(f"Added file from subfolder: {relative_path}")
+                        logger.debug(f"Added file from subfolder: {relative_path}")
         
-        logger.info(f"Returning {len(files)} files")
+        logger.debug(f"Returning {len(files)} files")
         return {"files": files}
     except Exception as e:
         logger.error(f"Error listing output files: {str(e)}")
@@ -1,8 +1,9 @@
-from fastapi import APIRouter, UploadFile, File, Depends, Body
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Request
 from pathlib import Path
 from typing import List, Optional, Dict, Any
-import aiofiles, tempfile, zipfile, os, shutil, asyncio, logging
+import tempfile, zipfile, hashlib, os, asyncio, logging
+
+from ..streaming_upload import stream_upload
 
 router = APIRouter(prefix="/builder", tags=["builder"])
 logger = logging.getLogger("uvicorn")
@@ -33,13 +34,34 @@ async def clear_debs():
         logger.error(f"Error clearing DEB files: {str(e)}")
         return {"error": f"Failed to clear DEB files: {str(e)}", "count": 0}
 
-async def save_upload_file(upload_file: UploadFile, destination: Path):
-    """Stream file from UploadFile to disk asynchronously"""
-    async with aiofiles.open(destination, "wb") as out_file:
-        while chunk := await upload_file.read(CHUNK_SIZE):
-            await out_file.write(chunk)
-    await upload_file.close()
-    return destination
+def extract_debs_from_zip(zip_path: Path, destination_dir: Path) -> List[Dict[str, Any]]:
+    """Stream every .deb inside a ZIP directly into destination_dir, hashing and committing each atomically"""
+    extracted = []
+    with zipfile.ZipFile(zip_path, "r") as archive:
+        for member in archive.infolist():
+            name = Path(member.filename).name
+            if member.is_dir() or not name.endswith(".deb"):
+                continue
+            dest_path = destination_dir / name
+            # Open the member before creating the temp file: encrypted members or unsupported
+            # compression methods fail here, with no file descriptor to leak
+            with archive.open(member) as src:
+                fd, tmp = tempfile.mkstemp(dir=destination_dir, prefix=f".{name}.", suffix=".part")
+                digest = hashlib.sha256()
+                try:
+                    with os.fdopen(fd, "wb") as out_file:
+                        while chunk := src.read(CHUNK_SIZE):
+                            out_file.write(chunk)
+                            digest.update(chunk)
+                        out_file.flush()
+                        os.fsync(out_file.fileno())
+                    os.replace(tmp, dest_path)
+                except Exception:
+                    Path(tmp).unlink(missing_ok=True)
+                    raise
+            logger.info(f"Extracted deb from zip: {dest_path}")
+            extracted.append({"name": name, "size": member.file_size, "sha256": digest.hexdigest()})
+    return extracted
 
 
 @router.post("/clear_debs")
@@ -49,85 +71,66 @@ async def clear_debs_endpoint():
 
 
 @router.post("/upload_debs")
-async def upload_file(files: Optional[List[UploadFile]] = File(None)):
-    # If no files provided, return error
-    if not files:
-        return {"error": "No files provided", "count": 0}
-    logger.info(f"Received upload request with {len(files)} files")
-    for file in files:
-        logger.info(f"File name: {file.filename}, Content type: {file.content_type}")
-    
+async def upload_file(request: Request):
+    """
+    Stream uploaded .deb and .zip files straight into DEBS_DIR.
+
+    The multipart body is parsed as it arrives, so each deb is written to disk exactly once.
+    ZIP uploads are written next to the debs under a hidden name, their .deb members are
+    extracted in place and the ZIP is removed.
+    """
+    # Process files in batches - this is a batch processing handler
+    # Don't clear debs directory at the start - we might be receiving files in multiple batches
+    received = []
+
+    def resolve_destination(filename: str) -> Optional[Path]:
+        received.append(filename)
+        name = Path(filename).name
+        logger.info(f"File name: {filename}")
+        if name.endswith(".deb"):
+            return DEBS_DIR / name
+        if name.endswith(".zip"):
+            # hidden and not *.deb, so clear_debs and the build script never pick it up
+            return DEBS_DIR / f".{name}"
+        return None
+
     try:
-        # target debs directory
-        debs_dir = Path("C:/Users/christian.leonard/Documents/code/IoT/Stratus/remote_update_manager/debs")
-        
-        # Create debs directory if it doesn't exist
-        debs_dir.mkdir(parents=True, exist_ok=True)
-        logger.info(f"Debs directory: {debs_dir}, exists: {debs_dir.exists()}")
+        DEBS_DIR.mkdir(parents=True, exist_ok=True)
+        logger.info(f"Debs directory: {DEBS_DIR}, exists: {DEBS_DIR.exists()}")
+
+        streamed = await stream_upload(request, resolve_destination)
+        if not received:
+            return {"error": "No files provided", "count": 0}
+        logger.info(f"Received upload request with {len(received)} files")
 
-        # Process files in batches - this is a batch processing handler
-        # Don't clear debs directory at the start - we might be receiving files in multiple batches
-        
         results = []
-        for file in files:
+        loop = asyncio.get_event_loop()
+        for item in streamed:
+            if item.path.name.endswith(".deb"):
+                results.append({"name": item.path.name, "size": item.size, "sha256": item.sha256})
+                continue
+
+            # If it's a zip archive → extract contents
             try:
-                filename = file.filename
-
-                # If it's a zip archive → extract contents
-                if filename.endswith(".zip"):
-                    tmp_zip = Path(tempfile.gettempdir()) / filename
-                    logger.info(f"Saving ZIP: {filename}")
-                    await save_upload_file(file, tmp_zip)
-
-                    extract_dir = Path(tempfile.gettempdir()) / f"{filename}_extracted"
-                    logger.info(f"Extracting ZIP to {extract_dir}")
-                    # run extraction in threadpool (zipfile is sync)
-                    loop = asyncio.get_event_loop()
-                    await loop.run_in_executor(None, lambda: zipfile.ZipFile(tmp_zip, "r").extractall(extract_dir))
-
-                    for root, _, extracted_files in os.walk(extract_dir):
-                        for ef in extracted_files:
-                            if ef.endswith(".deb"):
-                                ef_path = Path(root) / ef
-                                logger.info(f"Found deb in zip: {ef_path}")
-                                results.append(ef_path)
-
-                    # cleanup zip + extracted folder
-                    shutil.rmtree(extract_dir, ignore_errors=True)
-                    tmp_zip.unlink(missing_ok=True)
-
-                elif filename.endswith(".deb"):
-                    tmp_file = Path(tempfile.gettempdir()) / filename
-                    logger.info(f"Saving DEB: {filename}")
-                    await save_upload_file(file, tmp_file)
-                    results.append(tmp_file)
-
-                else:
-                    logger.warning(f"Skipping unsupported file: {filename}")
-                    continue
+                logger.info(f"Extracting ZIP {item.filename} into {DEBS_DIR}")
+                # run extraction in threadpool (zipfile is sync)
+                extracted = await loop.run_in_executor(None, extract_debs_from_zip, item.path, DEBS_DIR)
+                results.extend(extracted)
             except Exception as e:
-                logger.error(f"Error processing file {file.filename}: {str(e)}")
+                logger.error(f"Error processing file {item.filename}: {str(e)}")
                 # Continue with other files
+            finally:
+                item.path.unlink(missing_ok=True)
 
         if not results:
             return {"message": "No valid .deb files found in the upload", "count": 0}
 
-        # Move uploaded debs into debs dir (don't clear existing files)
-        moved_files = 0
-        for idx, item in enumerate(results, 1):
-            try:
-                dest_path = debs_dir / Path(item).name
-                logger.info(f"[{idx}/{len(results)}] Moving {item} → {dest_path}")
-                os.replace(item, dest_path)
-                moved_files += 1
-            except Exception as e:
-                logger.error(f"Error moving file {item}: {str(e)}")
-
         return {
-            "message": f"Processed {moved_files} .deb files into {debs_dir}",
-            "count": moved_files,
-            "total_files": len(files),
-            "processed_files": len(results)
+            "message": f"Processed {len(results)} .deb files into {DEBS_DIR}",
+            "count": len(results),
+            "total_files": len(received),
+            "processed_files": len(results),
+            "files": results
         }
     except Exception as e:
         logger.error(f"Upload error: {str(e)}")
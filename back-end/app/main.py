@@ -1,11 +1,30 @@
 from fastapi import FastAPI
+from contextlib import asynccontextmanager
+import asyncio
 from .api.commands import files, inputs, pipeline
-from .api.update_builder import build, upload_debs, result
+from .api.update_builder import build, upload_debs, result, matrix_build
 from .api.update_archives import pull_archive
+from .api import change_feed
 
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # background tasks that run for the lifetime of the server
+    compaction = asyncio.create_task(pull_archive.compaction_loop())
+    change_feed.feed.close_on_exit_signal()
+    watcher = asyncio.create_task(change_feed.feed.run())
+    yield
+    compaction.cancel()
+    await change_feed.feed.close()
+    # closing the feed stops the native watcher thread; give it a moment before cancelling
+    try:
+        await asyncio.wait_for(watcher, timeout=2)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        pass
+    pull_archive.archive_index.save()
+
+app = FastAPI(lifespan=lifespan)
 
 # command builder
 app.include_router(files.router, prefix="/api")
@@ -16,10 +35,14 @@ app.include_router(pipeline.router, prefix="/api")
 app.include_router(build.router, prefix="/api")
 app.include_router(upload_debs.router, prefix="/api")
 app.include_router(result.router, prefix="/api")
+app.include_router(matrix_build.router, prefix="/api")
 
 # update archives
 app.include_router(pull_archive.router, prefix="/api")
 
+# change notifications
+app.include_router(change_feed.router, prefix="/api")
+
 origins = [
     "http://localhost:5173",  # SvelteKit dev server
     "http://127.0.0.1:5173",
@@ -0,0 +1,186 @@
+// Client for the server's file change feed (/api/changes/stream).
+//
+// Browsers only allow ~6 HTTP/1.1 connections per origin, so tabs must not each hold their own
+// EventSource. One tab per browser is elected leader with the Web Locks API and owns the only
+// stream; it relays every event to the other tabs over a BroadcastChannel. When the leader tab
+// closes, its lock is released and the next tab takes over, resuming from the last seen event id.
+// Event ids are "<server boot id>:<seq>", so resuming against a restarted server yields a reset.
+
+export interface FileChange {
+    seq: number;
+    type: 'added' | 'modified' | 'removed';
+    root: 'output' | 'archive' | 'debs';
+    path: string;
+    size?: number;
+    mtime?: number;
+}
+
+export interface ChangeSubscription {
+    // True while the shared event stream is connected; when false, callers should fall back to polling
+    isLive(): boolean;
+    close(): void;
+}
+
+export interface ChangeWatcher extends ChangeSubscription {
+    // Resolves true as soon as something changed since the last call, false after timeoutMs
+    next(timeoutMs: number): Promise<boolean>;
+}
+
+type FeedMessage =
+    | { kind: 'change'; change: FileChange; id: string }
+    | { kind: 'reset'; id: string }
+    | { kind: 'status'; live: boolean; id: string | null }
+    | { kind: 'hello' };
+
+interface Listener {
+    roots: FileChange['root'][];
+    onChange: (change: FileChange) => void;
+    onReset?: () => void;
+}
+
+const FEED_NAME = 'aaon-tools-change-feed';
+
+const listeners = new Set<Listener>();
+let channel: BroadcastChannel | null = null;
+let source: EventSource | null = null;
+let abortLeaderRequest: AbortController | null = null;
+let releaseLeadership: (() => void) | null = null;
+let lastEventId: string | null = null;
+let live = false;
+
+function dispatch(message: FeedMessage) {
+    if (message.kind === 'change') {
+        lastEventId = message.id;
+        for (const listener of listeners) {
+            if (listener.roots.includes(message.change.root)) listener.onChange(message.change);
+        }
+    } else if (message.kind === 'reset') {
+        lastEventId = message.id;
+        for (const listener of listeners) listener.onReset?.();
+    } else if (message.kind === 'status') {
+        live = message.live;
+        if (lastEventId === null) lastEventId = message.id;
+    } else if (message.kind === 'hello' && source) {
+        // A tab just joined; tell it whether the stream is up
+        channel?.postMessage({ kind: 'status', live, id: lastEventId });
+    }
+}
+
+function publish(message: FeedMessage) {
+    dispatch(message);
+    channel?.postMessage(message);
+}
+
+function becomeLeader() {
+    const url =
+        lastEventId !== null
+            ? `/api/changes/stream?since=${encodeURIComponent(lastEventId)}`
+            : '/api/changes/stream';
+    source = new EventSource(url);
+    const stream = source;
+    stream.addEventListener('ready', (event) => {
+        const id = (event as MessageEvent).lastEventId;
+        if (lastEventId === null && id) lastEventId = id;
+    });
+    stream.addEventListener('change', (event) => {
+        const message = event as MessageEvent;
+        publish({ kind: 'change', change: JSON.parse(message.data), id: message.lastEventId });
+    });
+    // The server could not replay everything we missed (or restarted) - whatever we have may be stale
+    stream.addEventListener('reset', (event) => {
+        publish({ kind: 'reset', id: (event as MessageEvent).lastEventId });
+    });
+    stream.onopen = () => publish({ kind: 'status', live: true, id: lastEventId });
+    stream.onerror = () => {
+        publish({ kind: 'status', live: stream.readyState === EventSource.OPEN, id: lastEventId });
+    };
+}
+
+function start() {
+    if (typeof BroadcastChannel === 'undefined' || !('locks' in navigator)) {
+        // No way to coordinate with other tabs; fall back to a stream of our own
+        becomeLeader();
+        return;
+    }
+
+    channel = new BroadcastChannel(FEED_NAME);
+    channel.onmessage = (event) => dispatch(event.data as FeedMessage);
+    channel.postMessage({ kind: 'hello' });
+
+    abortLeaderRequest = new AbortController();
+    navigator.locks
+        .request(FEED_NAME, { signal: abortLeaderRequest.signal }, () => {
+            abortLeaderRequest = null;
+            becomeLeader();
+            // Hold the lock until this tab stops listening (or closes)
+            return new Promise<void>((resolve) => (releaseLeadership = resolve));
+        })
+        .catch(() => {
+            // aborted while waiting to become leader
+        });
+}
+
+function stop() {
+    source?.close();
+    source = null;
+    abortLeaderRequest?.abort();
+    abortLeaderRequest = null;
+    releaseLeadership?.();
+    releaseLeadership = null;
+    channel?.close();
+    channel = null;
+    live = false;
+}
+
+export function subscribeChanges(
+    roots: FileChange['root'][],
+    onChange: (change: FileChange) => void,
+    onReset?: () => void
+): ChangeSubscription {
+    const listener: Listener = { roots, onChange, onReset };
+    listeners.add(listener);
+    if (listeners.size === 1) start();
+
+    return {
+        isLive() {
+            return live;
+        },
+        close() {
+            if (listeners.delete(listener) && listeners.size === 0) stop();
+        }
+    };
+}
+
+export function watchChanges(roots: FileChange['root'][]): ChangeWatcher {
+    let pending = false;
+    let wake: (() => void) | null = null;
+
+    const notify = () => {
+        pending = true;
+        wake?.();
+    };
+    const subscription = subscribeChanges(roots, notify, notify);
+
+    return {
+        next(timeoutMs: number) {
+            if (pending) {
+                pending = false;
+                return Promise.resolve(true);
+            }
+            return new Promise<boolean>((resolve) => {
+                const timer = setTimeout(() => {
+                    wake = null;
+                    resolve(false);
+                }, timeoutMs);
+                wake = () => {
+                    clearTimeout(timer);
+                    wake = null;
+                    pending = false;
+                    resolve(true);
+                };
+            });
+        },
+        isLive: subscription.isLive,
+        close: subscription.close
+    };
+}